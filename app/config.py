@@ -0,0 +1,39 @@
+# app/config.py
+# CLIPFILE BACKEND — configuración compartida (rutas, clip, subtítulos, límites)
+
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STORAGE_INPUT = os.path.join(BASE_DIR, "storage", "input")
+STORAGE_OUTPUT = os.path.join(BASE_DIR, "storage", "output")
+STORAGE_TMP = os.path.join(BASE_DIR, "storage", "tmp")
+
+for p in [STORAGE_INPUT, STORAGE_OUTPUT, STORAGE_TMP]:
+    os.makedirs(p, exist_ok=True)
+
+RUNPOD_POD_URL = os.getenv("RUNPOD_POD_URL")
+if not RUNPOD_POD_URL:
+    raise RuntimeError("RUNPOD_POD_URL no definida")
+
+# Subtítulos: tamaños de referencia para un vídeo 1920x1080, se escalan al
+# tamaño real del clip. Centrados; una línea más ancha que el vídeo (menos
+# SUB_MARGIN a cada lado) se achica hasta entrar.
+FONT_PATH = os.path.join(BASE_DIR, "fonts", "Poppins-ExtraBold.ttf")
+SUB_REF_WIDTH = 1920
+SUB_REF_HEIGHT = 1080
+SUB_MARGIN = 40
+SUB_FONT_SIZE = 110
+SUB_COLOR = (0, 255, 255, 255)
+SUB_OUTLINE_COLOR = (0, 0, 0, 255)
+SUB_OUTLINE_SIZE = 6
+MAX_WORDS_ON_SCREEN = 2
+
+MIN_CLIP = 20
+MAX_CLIP = 30
+
+# Jobs concurrentes (cada ffmpeg usa -threads 1 → ~1 CPU por job)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# Tamaño máximo de subida (default 4 GiB)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(4 << 30)))
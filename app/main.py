@@ -5,47 +5,64 @@
 
 import os
 import uuid
+import glob
 import json
 import shutil
+import struct
+import functools
 import subprocess
-import requests
-import threading
-from fastapi import FastAPI, UploadFile, File
+import time
+import multiprocessing
+import httpx
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import FastAPI, UploadFile, File, Request, HTTPException
 from fastapi.responses import FileResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
+from PIL import Image, ImageDraw, ImageFont
+from app.config import (
+    STORAGE_INPUT,
+    STORAGE_OUTPUT,
+    STORAGE_TMP,
+    RUNPOD_POD_URL,
+    FONT_PATH,
+    SUB_REF_WIDTH,
+    SUB_REF_HEIGHT,
+    SUB_MARGIN,
+    SUB_FONT_SIZE,
+    SUB_COLOR,
+    SUB_OUTLINE_COLOR,
+    SUB_OUTLINE_SIZE,
+    MAX_WORDS_ON_SCREEN,
+    MIN_CLIP,
+    MAX_CLIP,
+    JOB_WORKERS,
+    MAX_UPLOAD_BYTES,
+)
+
+try:
+    from numba import njit
+except ImportError:
+    # Sin numba el kernel corre igual en Python puro
+    def njit(*args, **kwargs):
+        return lambda f: f
 
 # ============================================================
-# CONFIG
+# FASTAPI
 # ============================================================
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-
-STORAGE_INPUT = os.path.join(BASE_DIR, "storage", "input")
-STORAGE_OUTPUT = os.path.join(BASE_DIR, "storage", "output")
-STORAGE_TMP = os.path.join(BASE_DIR, "storage", "tmp")
-
-for p in [STORAGE_INPUT, STORAGE_OUTPUT, STORAGE_TMP]:
-    os.makedirs(p, exist_ok=True)
-
-RUNPOD_POD_URL = os.getenv("RUNPOD_POD_URL")
-if not RUNPOD_POD_URL:
-    raise RuntimeError("RUNPOD_POD_URL no definida")
-
-FONT_NAME = "Poppins ExtraBold"
-ASS_FONT_SIZE = 110
-ASS_PRIMARY = "&H00FFFF00"
-ASS_OUTLINE = "&H00000000"
-ASS_OUTLINE_SIZE = 6
-ASS_ALIGN = 5
-MAX_WORDS_ON_SCREEN = 2
+app = FastAPI(title="ClipFile Backend — ASYNC")
 
-MIN_CLIP = 20
-MAX_CLIP = 30
+# fork explícito: los workers heredan PROGRESS (proxy del Manager) sin
+# re-importar este módulo
+MP = multiprocessing.get_context("fork")
 
-# ============================================================
-# FASTAPI
-# ============================================================
+EXECUTOR = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=MP)
 
-app = FastAPI(title="ClipFile Backend — ASYNC")
+# Progreso en memoria compartida entre el proceso web y los workers
+MANAGER = MP.Manager()
+PROGRESS = MANAGER.dict()
 
 # ============================================================
 # UTILS
@@ -54,19 +71,87 @@ app = FastAPI(title="ClipFile Backend — ASYNC")
 def run(cmd):
     subprocess.run(cmd, check=True)
 
+def detect_cuda():
+    try:
+        subprocess.run(["nvidia-smi", "-L"], check=True, capture_output=True, timeout=10)
+        return True
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+def ffmpeg_encoders():
+    # Nombres de encoders de `ffmpeg -encoders` (líneas " V....D libx264 ...")
+    try:
+        out = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            check=True, capture_output=True, text=True, timeout=10,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return frozenset()
+    encoders = set()
+    for line in out.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[1] != "=":
+            encoders.add(parts[1])
+    return frozenset(encoders)
+
+# Capacidades detectadas una vez al arrancar; los workers (fork) las heredan
+HAS_CUDA = detect_cuda()
+FFMPEG_ENCODERS = ffmpeg_encoders()
+USE_NVENC = HAS_CUDA and "h264_nvenc" in FFMPEG_ENCODERS
+
+if USE_NVENC:
+    VIDEO_ENCODE = ["-c:v", "h264_nvenc", "-preset", "p1", "-cq", "23"]
+else:
+    VIDEO_ENCODE = ["-c:v", "libx264", "-preset", "ultrafast"]
+
+def progress_path(job_id):
+    return os.path.join(STORAGE_TMP, f"{job_id}.progress.json")
+
 def write_progress(job_id, percent):
-    with open(os.path.join(STORAGE_TMP, f"{job_id}.progress.json"), "w") as f:
-        json.dump({"percent": percent}, f)
+    last = PROGRESS.get(job_id)
+    # El JSON en disco queda como respaldo ante reinicios: se escribe cada
+    # 20% y al terminar/fallar, de forma atómica. Va antes que el dict para
+    # que un estado final ya esté en disco cuando se borre de memoria.
+    if last is None or percent in (100, -1) or percent // 20 > last // 20:
+        p = progress_path(job_id)
+        with open(p + ".tmp", "w") as f:
+            json.dump({"percent": percent}, f)
+        os.replace(p + ".tmp", p)
+    PROGRESS[job_id] = percent
+
+def prune_progress():
+    # Los jobs terminados (100 / -1) salen de memoria; /progress los sigue
+    # respondiendo desde el JSON de disco
+    for job_id, percent in PROGRESS.items():
+        if percent in (100, -1):
+            PROGRESS.pop(job_id, None)
+
+def save_upload(src, dst_path):
+    with open(dst_path, "wb") as f:
+        shutil.copyfileobj(src, f, 1 << 20)
+
+def accept_upload(src, job_id):
+    # Todo lo bloqueante del upload (disco + IPC con el Manager) fuera del event loop
+    save_upload(src, os.path.join(STORAGE_INPUT, f"{job_id}.mp4"))
+    prune_progress()
+    write_progress(job_id, 1)
 
-def extract_audio(video_path, wav_path):
-    run([
+def audio_cmd(video_path, out):
+    # WAV 16k mono; out = "pipe:1" para streaming o una ruta en disco
+    return [
         "ffmpeg", "-y",
         "-i", video_path,
+        "-threads", "1",
         "-vn",
         "-ac", "1",
         "-ar", "16000",
-        wav_path
-    ])
+        "-f", "wav",
+        out
+    ]
+
+def audio_stream(video_path):
+    # ffmpeg escribe el WAV a stdout; se consume en streaming
+    return subprocess.Popen(audio_cmd(video_path, "pipe:1"), stdout=subprocess.PIPE)
 
 def ffprobe_duration(path):
     r = subprocess.check_output([
@@ -77,66 +162,256 @@ def ffprobe_duration(path):
     ])
     return float(r.decode().strip())
 
+def ffprobe_video_size(path):
+    r = subprocess.check_output([
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height",
+        "-of", "csv=p=0",
+        path
+    ])
+    w, h = r.decode().strip().split(",")[:2]
+    return int(w), int(h)
+
+def mp4_boxes(f, start, end):
+    # Recorre los boxes (atoms) ISO-BMFF entre start y end: (tipo, ini, fin)
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack(">I4s", f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            raise ValueError("box MP4 inválido")
+        yield kind, pos + header, pos + size
+        pos += size
+
+def mp4_children(f, start, end, kind):
+    return ((s, e) for k, s, e in mp4_boxes(f, start, end) if k == kind)
+
+def mp4_moov(f):
+    f.seek(0, os.SEEK_END)
+    for start, end in mp4_children(f, 0, f.tell(), b"moov"):
+        return start, end
+    raise ValueError("moov no encontrado")
+
+def mp4_duration(path):
+    # Lee duration/timescale de moov/mvhd sin lanzar ffprobe
+    with open(path, "rb") as f:
+        for start, _ in mp4_children(f, *mp4_moov(f), b"mvhd"):
+            f.seek(start)
+            version = f.read(4)[0]
+            if version == 1:
+                _, _, timescale, duration = struct.unpack(">QQIQ", f.read(28))
+                unknown = 0xFFFFFFFFFFFFFFFF
+            else:
+                _, _, timescale, duration = struct.unpack(">IIII", f.read(16))
+                unknown = 0xFFFFFFFF
+            # 0 = MP4 fragmentado (la duración real está en moof), se usa ffprobe
+            if not timescale or duration in (0, unknown):
+                raise ValueError("mvhd sin duración")
+            return duration / timescale
+    raise ValueError("mvhd no encontrado")
+
+def mp4_video_size(path):
+    # Tamaño de presentación del primer trak con imagen (tkhd), con rotación
+    with open(path, "rb") as f:
+        for trak_start, trak_end in mp4_children(f, *mp4_moov(f), b"trak"):
+            for start, _ in mp4_children(f, trak_start, trak_end, b"tkhd"):
+                f.seek(start)
+                version = f.read(4)[0]
+                # fechas/track_id/duración + reserved/layer/group/volume
+                f.seek((32 if version == 1 else 20) + 16, os.SEEK_CUR)
+                matrix = struct.unpack(">9i", f.read(36))
+                w, h = struct.unpack(">II", f.read(8))
+                w, h = w >> 16, h >> 16
+                if w and h:
+                    if matrix[0] == 0:  # rotado 90/270
+                        w, h = h, w
+                    return w, h
+    raise ValueError("tkhd de vídeo no encontrado")
+
+def video_duration(path):
+    try:
+        return mp4_duration(path)
+    except (ValueError, struct.error, IndexError):
+        return ffprobe_duration(path)
+
+def video_size(path):
+    try:
+        return mp4_video_size(path)
+    except (ValueError, struct.error, IndexError):
+        return ffprobe_video_size(path)
+
 # ============================================================
 # RUNPOD
 # ============================================================
 
-def pod_transcribe_words(wav_path):
-    with open(wav_path, "rb") as f:
-        r = requests.post(
-            RUNPOD_POD_URL,
-            files={"file": f},
-            timeout=1800
-        )
-    r.raise_for_status()
-    data = r.json()
-    return data["words"]
+# Cliente compartido: keep-alive/HTTP2 (sin handshake TLS por job) y
+# reintentos de conexión. Los reintentos por status van en
+# pod_transcribe_words, que relanza ffmpeg para regenerar el body.
+CLIENT = httpx.Client(
+    timeout=httpx.Timeout(1800, connect=30),
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=3,
+        limits=httpx.Limits(max_connections=8, max_keepalive_connections=8),
+    ),
+)
+
+# 5xx transitorios del proxy de RunPod
+POD_RETRY_STATUS = (502, 503, 504)
+POD_RETRIES = 3
+# 429 = pod con todos los slots de GPU ocupados: se espera (Retry-After)
+# hasta este máximo en vez de fallar el job
+POD_BUSY_WAIT = 1800
+
+def retry_after(response, default):
+    value = response.headers.get("Retry-After", "")
+    return float(value) if value.isdigit() else default
+
+def wait_pod_slot(deadline):
+    # HEAD al endpoint (sin body): con el pod lleno se espera aquí, antes de
+    # lanzar ffmpeg, en vez de re-extraer y re-subir el audio en cada 429.
+    # Otro status (p.ej. 405 de un pod viejo) → se sigue al POST.
+    while time.monotonic() < deadline:
+        r = CLIENT.head(RUNPOD_POD_URL)
+        if r.status_code != 429:
+            return
+        time.sleep(retry_after(r, 5.0))
+
+def pod_transcribe_words(video_path, job_id):
+    attempt = 0
+    busy_deadline = time.monotonic() + POD_BUSY_WAIT
+    # Primer intento: audio en streaming desde ffmpeg. Si hay que reintentar,
+    # el WAV se extrae una sola vez a disco y se reenvía ese archivo.
+    wav_path = None
+    try:
+        while True:
+            wait_pod_slot(busy_deadline)
+            try:
+                return pod_transcribe_once(video_path, job_id, wav_path)
+            except httpx.HTTPStatusError as e:
+                status = e.response.status_code
+                # 429 en el POST = otro cliente ganó el slot tras el HEAD; el
+                # siguiente intento vuelve a esperar en wait_pod_slot
+                if status == 429 and time.monotonic() < busy_deadline:
+                    pass
+                elif status not in POD_RETRY_STATUS or attempt >= POD_RETRIES:
+                    raise
+                else:
+                    time.sleep(0.5 * 2 ** attempt)
+                    attempt += 1
+            if wav_path is None:
+                wav_path = os.path.join(STORAGE_TMP, f"{job_id}.wav")
+                run(audio_cmd(video_path, wav_path))
+    finally:
+        if wav_path and os.path.exists(wav_path):
+            os.remove(wav_path)
+
+def pod_transcribe_once(video_path, job_id, wav_path=None):
+    if wav_path:
+        with open(wav_path, "rb") as f:
+            words, done = pod_post_audio(iter(lambda: f.read(1 << 16), b""), job_id)
+    else:
+        proc = audio_stream(video_path)
+        try:
+            words, done = pod_post_audio(iter(lambda: proc.stdout.read(1 << 16), b""), job_id)
+        finally:
+            proc.stdout.close()
+            proc.wait()
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+    if not done:
+        raise RuntimeError("transcripción incompleta")
+    return words
+
+def pod_post_audio(chunks, job_id):
+    # El audio sube al pod según se lee (chunked); la respuesta es NDJSON:
+    # una línea por palabra y {"done": true} al final
+    words = []
+    done = False
+    with CLIENT.stream(
+        "POST",
+        RUNPOD_POD_URL,
+        content=chunks,
+        headers={"Content-Type": "audio/wav"},
+    ) as r:
+        r.raise_for_status()
+        write_progress(job_id, 20)
+        for line in r.iter_lines():
+            if not line:
+                continue
+            item = json.loads(line)
+            if "word" in item:
+                words.append(item)
+            elif item.get("done"):
+                done = True
+    return words, done
 
 # ============================================================
 # CLIP LOGIC
 # ============================================================
 
-def score_window(words, start_t, end_t):
-    score = 0.0
-    for w in words:
-        if w["end"] < start_t or w["start"] > end_t:
-            continue
-        score += 1.0
-    return score / max(end_t - start_t, 1.0)
+@njit(cache=True)
+def score_all(starts, ends, total_dur, min_clip, max_clip):
+    # Un único barrido en t para todas las duraciones: lo (palabras con
+    # end < t) es común, y cada duración tiene su cursor hi (start <= t+dur).
+    # Todos los cursores solo avanzan. Solo floats/ints → compilable con numba.
+    n = starts.shape[0]
+    n_durs = (max_clip - min_clip) // 2 + 1
+    his = np.zeros(n_durs, dtype=np.int64)
+    best_t = np.zeros(n_durs, dtype=np.float64)
+    best_c = np.full(n_durs, -1, dtype=np.int64)
+
+    lo = 0
+    for i in range(int(total_dur - min_clip) + 1):
+        t = float(i)
+        while lo < n and ends[lo] < t:
+            lo += 1
+        hi = 0
+        for k in range(n_durs):
+            dur = min_clip + 2 * k
+            if t + dur > total_dur:
+                break
+            # duraciones ascendentes → el hi de esta >= el de la anterior
+            hi = max(hi, his[k])
+            while hi < n and starts[hi] <= t + dur:
+                hi += 1
+            his[k] = hi
+            if hi - lo > best_c[k]:
+                best_c[k] = hi - lo
+                best_t[k] = t
+
+    t0, t1 = 0.0, float(min_clip)
+    best_score = -1.0
+    for k in range(n_durs):
+        dur = min_clip + 2 * k
+        if best_c[k] < 0:
+            break
+        s = best_c[k] / max(dur, 1.0)
+        if s > best_score:
+            best_score = s
+            t0, t1 = best_t[k], best_t[k] + dur
+    return t0, t1
 
 def pick_best_window(words, total_dur):
-    best = (0, MIN_CLIP)
-    best_score = -1
-    for dur in range(MIN_CLIP, MAX_CLIP + 1, 2):
-        t = 0.0
-        while t + dur <= total_dur:
-            s = score_window(words, t, t + dur)
-            if s > best_score:
-                best_score = s
-                best = (t, t + dur)
-            t += 1.0
-    return best
-
-def ts_ass(t):
-    h = int(t // 3600)
-    m = int((t % 3600) // 60)
-    s = t % 60
-    return f"{h}:{m:02d}:{s:05.2f}"
-
-def build_ass(words, clip_start, clip_end, ass_path):
-    header = f"""[Script Info]
-ScriptType: v4.00+
-PlayResX: 1920
-PlayResY: 1080
-
-[V4+ Styles]
-Format: Name, Fontname, Fontsize, PrimaryColour, OutlineColour, Outline, Alignment
-Style: Default,{FONT_NAME},{ASS_FONT_SIZE},{ASS_PRIMARY},{ASS_OUTLINE},{ASS_OUTLINE_SIZE},{ASS_ALIGN}
-
-[Events]
-Format: Start, End, Style, Text
-"""
-    lines = [header]
+    if total_dur < MIN_CLIP:
+        return (0, MIN_CLIP)
+
+    starts = np.sort(np.fromiter((w["start"] for w in words), dtype=np.float64, count=len(words)))
+    ends = np.sort(np.fromiter((w["end"] for w in words), dtype=np.float64, count=len(words)))
+    t0, t1 = score_all(starts, ends, float(total_dur), MIN_CLIP, MAX_CLIP)
+    return (float(t0), float(t1))
+
+def subtitle_lines(words, clip_start, clip_end):
+    # Agrupa de a MAX_WORDS_ON_SCREEN palabras: [(t0, t1, texto)] relativo al clip
+    lines = []
     buf = []
     buf_start = None
 
@@ -151,19 +426,69 @@ Format: Start, End, Style, Text
         buf.append(w["word"])
 
         if len(buf) >= MAX_WORDS_ON_SCREEN:
-            lines.append(
-                f"Dialogue: {ts_ass(buf_start)},{ts_ass(t1)},Default,{' '.join(buf)}\n"
-            )
+            lines.append((buf_start, t1, " ".join(buf)))
             buf = []
             buf_start = None
 
     if buf and buf_start is not None:
-        lines.append(
-            f"Dialogue: {ts_ass(buf_start)},{ts_ass(clip_end-clip_start)},Default,{' '.join(buf)}\n"
+        lines.append((buf_start, clip_end - clip_start, " ".join(buf)))
+
+    return lines
+
+@functools.lru_cache(maxsize=None)
+def load_font(size):
+    return ImageFont.truetype(FONT_PATH, size)
+
+def render_text_png(text, size, outline, max_w, png_path):
+    # Achica fuente y borde en proporción hasta que la línea entre en max_w
+    base_size, base_outline = size, outline
+    while True:
+        font = load_font(size)
+        left, top, right, bottom = font.getbbox(text, stroke_width=outline)
+        width = right - left
+        if width <= max_w or size <= 1:
+            break
+        size = max(1, min(size - 1, int(size * max_w / width)))
+        outline = max(1, round(base_outline * size / base_size))
+
+    img = Image.new("RGBA", (max(width, 1), max(bottom - top, 1)), (0, 0, 0, 0))
+    ImageDraw.Draw(img).text(
+        (-left, -top), text,
+        font=font,
+        fill=SUB_COLOR,
+        stroke_width=outline,
+        stroke_fill=SUB_OUTLINE_COLOR,
+    )
+    img.save(png_path)
+
+def build_overlays(words, clip_start, clip_end, video_w, video_h, png_prefix):
+    # Cada línea se rasteriza una sola vez a PNG (en vez de libass por frame)
+    scale = min(video_h / SUB_REF_HEIGHT, video_w / SUB_REF_WIDTH)
+    size = max(1, round(SUB_FONT_SIZE * scale))
+    outline = max(1, round(SUB_OUTLINE_SIZE * scale))
+    max_w = max(1, video_w - 2 * round(SUB_MARGIN * scale))
+
+    overlays = []
+    for i, (t0, t1, text) in enumerate(subtitle_lines(words, clip_start, clip_end)):
+        png_path = f"{png_prefix}_{i}.png"
+        render_text_png(text, size, outline, max_w, png_path)
+        overlays.append((png_path, t0, t1))
+    return overlays
+
+def overlay_filter(overlays):
+    # Input 0 = vídeo, input i+1 = PNG i, visible solo en su rango de tiempo.
+    # Un overlay deshabilitado deja pasar el frame sin mezclar: medido más
+    # rápido que un único stream concat, que mezcla un lienzo en cada frame
+    chain = []
+    prev = "0:v"
+    for i, (_, t0, t1) in enumerate(overlays):
+        out = f"v{i + 1}"
+        chain.append(
+            f"[{prev}][{i + 1}:v]overlay=x=(W-w)/2:y=(H-h)/2"
+            f":enable='between(t,{t0:.3f},{t1:.3f})'[{out}]"
         )
-
-    with open(ass_path, "w", encoding="utf-8") as f:
-        f.writelines(lines)
+        prev = out
+    return ";".join(chain), f"[{prev}]"
 
 # ============================================================
 # BACKGROUND WORKER
@@ -174,40 +499,40 @@ def process_job(job_id):
         write_progress(job_id, 5)
 
         input_video = os.path.join(STORAGE_INPUT, f"{job_id}.mp4")
-        wav_path = os.path.join(STORAGE_TMP, f"{job_id}.wav")
-
-        extract_audio(input_video, wav_path)
-        write_progress(job_id, 20)
 
-        words = pod_transcribe_words(wav_path)
+        words = pod_transcribe_words(input_video, job_id)
         write_progress(job_id, 50)
 
-        total_dur = ffprobe_duration(input_video)
+        total_dur = video_duration(input_video)
         clip_start, clip_end = pick_best_window(words, total_dur)
         write_progress(job_id, 65)
 
-        clip_video = os.path.join(STORAGE_TMP, f"{job_id}_clip.mp4")
-        run([
-            "ffmpeg", "-y",
-            "-ss", str(clip_start),
-            "-to", str(clip_end),
-            "-i", input_video,
-            "-c", "copy",
-            clip_video
-        ])
-
-        ass_path = os.path.join(STORAGE_TMP, f"{job_id}.ass")
-        build_ass(words, clip_start, clip_end, ass_path)
+        video_w, video_h = video_size(input_video)
+        overlays = build_overlays(
+            words, clip_start, clip_end, video_w, video_h,
+            os.path.join(STORAGE_TMP, f"{job_id}_sub"),
+        )
         write_progress(job_id, 80)
 
+        # Corte + subtítulos en una sola pasada (-ss antes de -i = seek rápido)
         final_out = os.path.join(STORAGE_OUTPUT, f"{job_id}.mp4")
-        run([
-            "ffmpeg", "-y",
-            "-i", clip_video,
-            "-vf", f"ass={ass_path}:fontsdir=/app/fonts",
-            "-c:a", "copy",
-            final_out
-        ])
+        cmd = ["ffmpeg", "-y"]
+        if USE_NVENC:
+            cmd += ["-hwaccel", "cuda"]
+        cmd += [
+            "-ss", str(clip_start),
+            "-to", str(clip_end),
+            "-i", input_video,
+        ]
+        for png_path, _, _ in overlays:
+            cmd += ["-i", png_path]
+        cmd += ["-threads", "1"]
+        if overlays:
+            graph, vout = overlay_filter(overlays)
+            cmd += ["-filter_complex", graph, "-map", vout, "-map", "0:a?"]
+        cmd += VIDEO_ENCODE
+        cmd += ["-c:a", "copy", "-movflags", "+faststart", final_out]
+        run(cmd)
 
         write_progress(job_id, 100)
 
@@ -215,39 +540,112 @@ def process_job(job_id):
         write_progress(job_id, -1)
         print("JOB ERROR:", job_id, repr(e))
 
+    finally:
+        # PNGs de subtítulos (también los de un build_overlays a medias)
+        for png_path in glob.glob(os.path.join(STORAGE_TMP, f"{job_id}_sub_*.png")):
+            os.remove(png_path)
+
+def job_done(job_id, future):
+    # process_job captura sus errores: aquí solo llegan fallos del pool
+    # (p.ej. un worker muerto de golpe → BrokenProcessPool)
+    e = future.exception()
+    if e is not None:
+        write_progress(job_id, -1)
+        print("JOB ERROR:", job_id, repr(e))
+
+def submit_job(job_id):
+    global EXECUTOR
+    try:
+        future = EXECUTOR.submit(process_job, job_id)
+    except BrokenProcessPool:
+        # Un worker murió y el pool quedó inutilizable: se rehace
+        EXECUTOR.shutdown(wait=False)
+        EXECUTOR = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=MP)
+        future = EXECUTOR.submit(process_job, job_id)
+    future.add_done_callback(lambda f: job_done(job_id, f))
+
 # ============================================================
 # ENDPOINTS
 # ============================================================
 
+class UploadTooLarge(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=413, detail="archivo demasiado grande")
+
+class UploadLimitMiddleware:
+    # ASGI puro y solo para /upload (el resto, p.ej. /download, pasa directo).
+    # Corta por Content-Length o, si no viene, contando bytes en receive():
+    # el body se aborta antes de que multipart termine de volcarlo a disco.
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != "/upload":
+            return await self.app(scope, receive, send)
+
+        clen = dict(scope["headers"]).get(b"content-length", b"")
+        if clen.isdigit() and int(clen) > self.max_bytes:
+            response = JSONResponse({"error": "archivo demasiado grande"}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise UploadTooLarge()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
+
+@app.exception_handler(UploadTooLarge)
+async def upload_too_large(request: Request, exc: UploadTooLarge):
+    return JSONResponse({"error": exc.detail}, status_code=413)
+
 @app.post("/upload")
 async def upload(file: UploadFile = File(...)):
     job_id = str(uuid.uuid4())
 
-    input_video = os.path.join(STORAGE_INPUT, f"{job_id}.mp4")
-    with open(input_video, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    await run_in_threadpool(accept_upload, file.file, job_id)
 
-    write_progress(job_id, 1)
-
-    t = threading.Thread(target=process_job, args=(job_id,))
-    t.start()
+    submit_job(job_id)
 
     return {"job_id": job_id}
 
 @app.get("/progress/{job_id}")
 def progress(job_id: str):
-    p = os.path.join(STORAGE_TMP, f"{job_id}.progress.json")
+    percent = PROGRESS.get(job_id)
+    if percent is not None:
+        if percent in (100, -1):
+            PROGRESS.pop(job_id, None)
+        return {"percent": percent}
+    p = progress_path(job_id)
     if not os.path.exists(p):
         return {"percent": 0}
     with open(p) as f:
         return json.load(f)
 
-@app.get("/download/{job_id}")
+@app.api_route("/download/{job_id}", methods=["GET", "HEAD"])
 def download(job_id: str):
     path = os.path.join(STORAGE_OUTPUT, f"{job_id}.mp4")
-    if not os.path.exists(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
         return JSONResponse({"error": "clip no listo"}, status_code=404)
-    return FileResponse(path, media_type="video/mp4", filename=f"{job_id}.mp4")
+    # stat_result ya resuelto → FileResponse no vuelve a hacer stat y puede
+    # servir Range / HEAD y usar zero-copy si el servidor lo soporta
+    return FileResponse(
+        path,
+        stat_result=st,
+        media_type="video/mp4",
+        filename=f"{job_id}.mp4",
+    )
 
 @app.get("/")
 def root():
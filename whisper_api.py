@@ -1,11 +1,21 @@
-from fastapi import FastAPI, UploadFile, File
-from faster_whisper import WhisperModel
-import tempfile, uvicorn, os, asyncio, subprocess
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import StreamingResponse, Response
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+from concurrent.futures import ThreadPoolExecutor
+import tempfile, uvicorn, os, asyncio, subprocess, json, struct
 
 # ===== CONFIG =====
 MODEL_SIZE = os.getenv("MODEL", "medium")
 DEVICE = "cuda"
-COMPUTE_TYPE = "float16"
+# int8_float16: pesos int8, activaciones fp16 → ~mitad de VRAM
+COMPUTE_TYPE = os.getenv("COMPUTE_TYPE", "int8_float16")
+VAD_FILTER = os.getenv("VAD_FILTER", "1") == "1"
+# Chunks de VAD decodificados juntos en la GPU (1 = sin batching)
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "16"))
+# Peticiones admitidas a la vez (subiendo o transcribiendo); el resto → 429
+GPU_SLOTS = int(os.getenv("GPU_SLOTS", "2"))
+# Segundos sugeridos al cliente para reintentar tras un 429
+RETRY_AFTER = int(os.getenv("RETRY_AFTER", "5"))
 
 # Cargar modelo una sola vez
 model = WhisperModel(
@@ -13,51 +23,156 @@ model = WhisperModel(
     device=DEVICE,
     compute_type=COMPUTE_TYPE
 )
+batched_model = BatchedInferencePipeline(model=model)
 
 app = FastAPI()
 
-# ---------- FUNCIÓN BLOQUEANTE ----------
-def _transcribe_sync(audio_bytes: bytes):
-    # Guardar audio original
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as t:
-        t.write(audio_bytes)
-        raw_path = t.name
-
-    # Convertir a WAV PCM mono 16k (OBLIGATORIO)
-    pcm_path = raw_path + "_16k.wav"
-    subprocess.run(
-        ["ffmpeg", "-y", "-i", raw_path, "-ac", "1", "-ar", "16000", pcm_path],
-        check=True
-    )
+# Todo el trabajo de GPU (transcribe + iterar segments) en un único hilo:
+# sin VRAM OOM ni kernels de varias peticiones peleando por la GPU
+GPU_POOL = ThreadPoolExecutor(max_workers=1)
+GPU_SEM = asyncio.Semaphore(GPU_SLOTS)
+
+# ---------- FUNCIONES BLOQUEANTES ----------
+def _is_pcm16k_mono(path: str) -> bool:
+    # Mira el chunk "fmt " del header RIFF: PCM 16-bit, 1 canal, 16000 Hz
+    try:
+        with open(path, "rb") as f:
+            riff = f.read(12)
+            if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:] != b"WAVE":
+                return False
+            while True:
+                head = f.read(8)
+                if len(head) < 8:
+                    return False
+                kind, size = struct.unpack("<4sI", head)
+                if kind == b"fmt ":
+                    fmt, channels, rate, _, _, bits = struct.unpack("<HHIIHH", f.read(16))
+                    return fmt == 1 and channels == 1 and rate == 16000 and bits == 16
+                f.seek(size + (size & 1), os.SEEK_CUR)
+    except (OSError, struct.error):
+        return False
+
+def _transcribe_sync(raw_path: str):
+    tmp_paths = [raw_path]
+    pcm_path = raw_path
+    # El backend ya manda WAV PCM mono 16k: solo se convierte si no lo es
+    if not _is_pcm16k_mono(raw_path):
+        pcm_path = raw_path + "_16k.wav"
+        tmp_paths.append(pcm_path)
+        subprocess.run(
+            ["ffmpeg", "-y", "-i", raw_path, "-ac", "1", "-ar", "16000", pcm_path],
+            check=True
+        )
+
+    # Transcribir: segments es un generador, el decode ocurre al iterarlo
+    # El batching necesita los cortes de VAD; sin VAD va secuencial
+    if VAD_FILTER and BATCH_SIZE > 1:
+        segments, info = batched_model.transcribe(
+            pcm_path,
+            word_timestamps=True,
+            vad_filter=True,
+            batch_size=BATCH_SIZE,
+        )
+    else:
+        segments, info = model.transcribe(
+            pcm_path,
+            word_timestamps=True,
+            vad_filter=VAD_FILTER,  # salta silencios
+        )
+    return info, segments, tmp_paths
 
-    # Transcribir
-    segments, info = model.transcribe(pcm_path, word_timestamps=True)
+def _ndjson_words(info, segments, tmp_paths):
+    # Una línea JSON por palabra según se decodifica; {"done": true} al final
+    # para que el cliente distinga un stream completo de uno cortado
+    try:
+        yield json.dumps({"language": info.language}) + "\n"
+        for s in segments:
+            if s.words:
+                for w in s.words:
+                    yield json.dumps({
+                        "word": w.word.strip(),
+                        "start": float(w.start),
+                        "end": float(w.end),
+                    }) + "\n"
+        yield json.dumps({"done": True}) + "\n"
+    except Exception as e:
+        print("POD ERROR:", repr(e))
+        raise
+    finally:
+        for p in tmp_paths:
+            if os.path.exists(p):
+                os.remove(p)
 
-    words = []
-    for s in segments:
-        if s.words:
-            for w in s.words:
-                words.append({
-                    "word": w.word.strip(),
-                    "start": float(w.start),
-                    "end": float(w.end),
-                })
+async def _stream_words(raw_path: str):
+    # Libera el slot de GPU cuando el stream termina, falla o se abandona
+    loop = asyncio.get_running_loop()
+    lines = None
+    try:
+        info, segments, tmp_paths = await loop.run_in_executor(GPU_POOL, _transcribe_sync, raw_path)
+        lines = _ndjson_words(info, segments, tmp_paths)
+        while True:
+            line = await loop.run_in_executor(GPU_POOL, next, lines, None)
+            if line is None:
+                break
+            yield line
+    finally:
+        if lines is not None:
+            # En el hilo de GPU, detrás de un next() que pueda seguir en curso
+            GPU_POOL.submit(lines.close)
+        elif os.path.exists(raw_path):
+            os.remove(raw_path)
+        GPU_SEM.release()
 
-    return {
-        "language": info.language,
-        "words": words,
-    }
+async def _prepend(first: str, rest):
+    yield first
+    async for line in rest:
+        yield line
 
 # ---------- ENDPOINT ----------
+def _gpu_busy():
+    return HTTPException(
+        status_code=429,
+        detail="GPU ocupada",
+        headers={"Retry-After": str(RETRY_AFTER)},
+    )
+
+@app.head("/transcribe")
+async def transcribe_slots():
+    # Admisión sin body: el backend pregunta antes de extraer y subir audio
+    if GPU_SEM.locked():
+        raise _gpu_busy()
+    return Response(status_code=200)
+
 @app.post("/transcribe")
-async def transcribe(file: UploadFile = File(...)):
+async def transcribe(request: Request):
+    if GPU_SEM.locked():
+        raise _gpu_busy()
+    await GPU_SEM.acquire()
+
+    # Body = WAV en streaming (chunked): se vuelca a disco según llega
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as t:
+            raw_path = t.name
+            async for chunk in request.stream():
+                t.write(chunk)
+    except Exception as e:
+        os.remove(raw_path)
+        GPU_SEM.release()
+        print("POD ERROR:", repr(e))
+        raise
+
+    # Primera línea antes de responder: los errores de transcribe salen como
+    # 500 y el generador ya arrancado siempre llega a su finally
+    stream = _stream_words(raw_path)
     try:
-        audio_bytes = await file.read()
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, _transcribe_sync, audio_bytes)
+        first = await stream.__anext__()
     except Exception as e:
         print("POD ERROR:", repr(e))
         raise
+    return StreamingResponse(
+        _prepend(first, stream),
+        media_type="application/x-ndjson",
+    )
 
 
 @app.get("/")